@@ -2,11 +2,18 @@ import streamlit as st
 import time
 from datetime import datetime
 import os
-import weaviate
-import weaviate.classes as wvc
 from sentence_transformers import SentenceTransformer
 import logging
 
+import search
+from weaviate_pool import (
+    ClientPool,
+    PoolTimeout,
+    is_timeout,
+    local_connector,
+    start_embedded,
+)
+
 logging.basicConfig(
     filename="app.log",
     datefmt="%d-%b-%y %H:%M:%S",
@@ -28,6 +35,12 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 SEARCH_MODE = ("nach Begriffen", "mit Referenzdokument")
 
+# Maximum number of concurrent queries to Weaviate. Further queries wait for a
+# free client up to ACQUIRE_TIMEOUT seconds and are then rejected.
+POOL_SIZE = 8
+ACQUIRE_TIMEOUT = 10
+QUERY_TIMEOUT = 30
+
 
 # ---------------------------------------------------------------
 # Functions
@@ -64,14 +77,24 @@ def create_project_info(project_info):
 
 
 @st.cache_resource
-def instantiate_client():
-    """Instantiate Weaviate client."""
+def start_weaviate():
+    """Start embedded Weaviate. The cached client keeps the instance running."""
     # Set this path to the path where the index is stored.
-    # client = weaviate.connect_to_embedded(persistence_data_path="/data01/weaviate_index")
+    # return start_embedded(persistence_data_path="/data01/weaviate_index")
 
     # Use this line for local testing where the index is stored in the default path.
-    client = weaviate.connect_to_embedded()
-    return client.collections.get("stazh")
+    return start_embedded()
+
+
+@st.cache_resource
+def instantiate_pool():
+    """Instantiate a pool of Weaviate clients shared by all sessions."""
+    start_weaviate()
+    return ClientPool(
+        local_connector(query_timeout=QUERY_TIMEOUT),
+        size=POOL_SIZE,
+        acquire_timeout=ACQUIRE_TIMEOUT,
+    )
 
 
 @st.cache_resource
@@ -90,11 +113,11 @@ def embed_query(query):
     return model.encode(query, convert_to_tensor=False, normalize_embeddings=True)
 
 
-def log_interaction(start_time, raw_search_terms):
-    """Log interaction."""
+def log_interaction(start_time, raw_search_terms, route):
+    """Log interaction with the route that answered it."""
     end_time = time.time()
     logging.warning(
-        f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\t{end_time - start_time:.3f}\t{raw_search_terms}"
+        f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\t{end_time - start_time:.3f}\t{route}\t{raw_search_terms}"
     )
 
 
@@ -117,62 +140,78 @@ def list_results(final_results):
         )
 
 
-def search_by_terms():
-    """Search by search terms."""
-    start_time = time.time()
+def is_busy(error):
+    """Whether the search failed because no client was free or the query timed out."""
+    return isinstance(error, PoolTimeout) or is_timeout(error)
 
-    raw_search_terms = []
-    search_terms = []
 
-    if search_box != "":
-        raw_search_terms = search_box
+def get_error_route(error):
+    """Get route to log for a failed search."""
+    return "timeout" if is_busy(error) else "error"
 
-    if raw_search_terms != []:
-        search_terms = raw_search_terms
 
-        vector = embed_query(search_terms)
+def show_search_error(error):
+    """Show message for a failed search."""
+    if is_busy(error):
+        st.error(
+            "Die Suche ist im Moment stark ausgelastet. Bitte versuchen Sie es in einigen Sekunden nochmals."
+        )
+    else:
+        logging.error(f"Search failed: {error!r}")
+        st.error("Bei der Suche ist ein Fehler aufgetreten.")
+
 
-        response = collection.query.hybrid(
-            query=search_terms,
-            query_properties=["title", "chunk_text"],
-            vector=list(vector),
-            limit=top_k,
+def search_by_terms():
+    """Search by search terms."""
+    start_time = time.time()
+
+    search_terms = search_box.strip()
+    if search_terms == "":
+        return
+
+    try:
+        final_results, route = search.route_and_search(
+            pool,
+            embed_query,
+            search_terms,
             alpha=hybrid_balance,
-            fusion_type=wvc.query.HybridFusion.RELATIVE_SCORE,
-            filters=wvc.query.Filter.by_property("year").greater_or_equal(sl_year[0])
-            & wvc.query.Filter.by_property("year").less_or_equal(sl_year[1])
-            & wvc.query.Filter.by_property("series").contains_any(include_series),
+            limit=top_k,
+            years=sl_year,
+            series=include_series,
         )
+    except Exception as e:
+        show_search_error(e)
+        log_interaction(start_time, search_terms, get_error_route(e))
+        return
 
-        seen = []
-        final_results = []
-        if response.objects is not None:
-            for result in response.objects:
-                if result.properties["identifier"] in seen:
-                    continue
-                final_results.append(result)
-                seen.append(result.properties["identifier"])
-
-        list_results(final_results)
-        log_interaction(start_time, raw_search_terms)
+    list_results(final_results)
+    log_interaction(start_time, search_terms, route)
 
 
 def search_by_reference_document():
     start_time = time.time()
 
-    response = collection.query.fetch_objects(
-        filters=wvc.query.Filter.by_property("stazh_ident").equal(signature)
-    )
+    try:
+        with pool.collection() as collection:
+            reference, final_results = search.search_by_reference_document(
+                collection,
+                signature,
+                limit=top_k,
+                years=sl_year,
+                series=include_series,
+            )
+    except Exception as e:
+        show_search_error(e)
+        log_interaction(start_time, signature, get_error_route(e))
+        return
 
-    if response.objects == []:
+    if reference is None:
         st.markdown(
             f"Es existiert kein Dokument mit Signatur **{signature}** in der Datenbank."
         )
         return
 
-    uuid = response.objects[0].uuid
-
-    result = response.objects[0].properties
+    result = reference.properties
 
     st.subheader("Suche mit Referenzdokument")
     st.markdown(
@@ -191,34 +230,15 @@ def search_by_reference_document():
     )
     st.markdown("---")
 
-    response = collection.query.near_object(
-        near_object=uuid,
-        limit=top_k,
-        filters=wvc.query.Filter.by_property("year").greater_or_equal(sl_year[0])
-        & wvc.query.Filter.by_property("year").less_or_equal(sl_year[1])
-        & wvc.query.Filter.by_property("series").contains_any(include_series),
-    )
-
-    # The first result is the reference document itself.
-    responses = response.objects[1:]
-
-    seen = []
-    final_results = []
-    for result in responses:
-        if result.properties["stazh_ident"] in seen:
-            continue
-        final_results.append(result)
-        seen.append(result.properties["stazh_ident"])
-
     list_results(final_results)
-    log_interaction(start_time, signature)
+    log_interaction(start_time, signature, "reference")
 
 
 # ---------------------------------------------------------------
 # Main
 
 model = load_model()
-collection = instantiate_client()
+pool = instantiate_pool()
 project_info = get_project_info()
 
 
@@ -0,0 +1,222 @@
+"""Load test of the search with an increasing number of concurrent users.
+
+Each simulated user runs searches one after another for `--duration` seconds,
+using the same code paths and client pool as the app. For each number of users
+we report throughput and latency percentiles of the Weaviate queries (including
+waiting for a free client) and the mean time to embed a query.
+
+Usage (from the folder _streamlit_app):
+    uv run python load_test.py
+    uv run python load_test.py --users 1 4 16 64 --pool-size 8 --alpha 0.0
+    uv run python load_test.py --port 8079 --grpc-port 50050  # Weaviate already running
+"""
+
+import os
+import time
+import random
+import argparse
+import threading
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+import search
+from weaviate_pool import ClientPool, PoolTimeout, local_connector, start_embedded
+
+# Suppress Hugginface warning about tokenizers.
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+QUERIES = [
+    "Was hat der Kantonsrat zu den Themen 'Schulhaus' und 'Schulraum' beschlossen?",
+    "Was ist zu Steuerreformen entschieden worden?",
+    "Bau der Eisenbahn",
+    "Armenwesen und Armenpflege in den Gemeinden",
+    "Cholera",
+    "Frauenstimmrecht",
+    "Gewässerschutz und Abwasserreinigung",
+    "StAZH MM 1.5 RRB 1804/0001",
+    "RRB 1804/1",
+]
+SIGNATURES = ["StAZH MM 1.5 RRB 1804/0001", "StAZH ABl 1987 (S. 1079)"]
+YEARS = [1803, 2001]
+SERIES = ["krp", "rrb", "os", "abl"]
+
+# Seconds a user waits after a failed search, doubled after each further failure.
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 5
+
+
+def load_model():
+    """Load sentence transformers language model."""
+    model_path = "jinaai/jina-embeddings-v2-base-de"
+    model = SentenceTransformer(
+        model_path,
+        trust_remote_code=True,
+    )
+    model.max_seq_length = 512
+    return model
+
+
+def simulate_user(pool, embed_query, args, deadline, latencies, embed_times, errors):
+    """Run searches until the deadline and record latencies and errors.
+
+    Searches use the same routes as the app. `latencies` covers waiting for a
+    client and the Weaviate queries, `embed_times` the encoder, which runs before
+    borrowing a client. After an error the user backs off, so that a failing
+    instance isn't flooded.
+    """
+    rng = random.Random()
+    backoff = MIN_BACKOFF
+    embed_time = 0.0
+
+    def timed_embed_query(query):
+        nonlocal embed_time
+        start = time.time()
+        vector = embed_query(query)
+        embed_time = time.time() - start
+        embed_times.append(embed_time)
+        return vector
+
+    while time.time() < deadline:
+        reference = rng.random() < args.reference_share
+        query = rng.choice(SIGNATURES if reference else QUERIES)
+        embed_time = 0.0
+
+        start = time.time()
+        try:
+            if reference:
+                with pool.collection() as collection:
+                    search.search_by_reference_document(
+                        collection, query, args.top_k, YEARS, SERIES
+                    )
+            else:
+                search.route_and_search(
+                    pool,
+                    timed_embed_query,
+                    query,
+                    args.alpha,
+                    args.top_k,
+                    YEARS,
+                    SERIES,
+                )
+        except Exception as e:
+            errors.append("pool" if isinstance(e, PoolTimeout) else type(e).__name__)
+            time.sleep(min(backoff, max(deadline - time.time(), 0)))
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            continue
+        latencies.append(time.time() - start - embed_time)
+        backoff = MIN_BACKOFF
+
+
+def run_level(pool, embed_query, args, n_users, duration):
+    """Run `n_users` concurrent users for `duration` seconds.
+
+    Returns
+    -------
+    tuple
+        Elapsed time, latencies of the Weaviate queries, embedding times and errors.
+    """
+    latencies = []
+    embed_times = []
+    errors = []
+    deadline = time.time() + duration
+    users = [
+        threading.Thread(
+            target=simulate_user,
+            args=(pool, embed_query, args, deadline, latencies, embed_times, errors),
+        )
+        for _ in range(n_users)
+    ]
+    start = time.time()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    return time.time() - start, np.array(latencies), np.array(embed_times), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--users",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="Numbers of concurrent users to test.",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Seconds per number of users."
+    )
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--acquire-timeout", type=float, default=10)
+    parser.add_argument("--query-timeout", type=int, default=30)
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.7,
+        help="Balance lexical / semantic as set in the app.",
+    )
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument(
+        "--reference-share",
+        type=float,
+        default=0.1,
+        help="Share of searches with a reference document.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=None,
+        help="Port of a running Weaviate instance, by default start embedded Weaviate.",
+    )
+    parser.add_argument("--grpc-port", type=int, default=50050)
+    args = parser.parse_args()
+
+    model = load_model()
+
+    def embed_query(query):
+        return model.encode(query, convert_to_tensor=False, normalize_embeddings=True)
+
+    if args.port is None:
+        server = start_embedded()
+        connect = local_connector(query_timeout=args.query_timeout)
+    else:
+        server = None
+        connect = local_connector(
+            query_timeout=args.query_timeout, port=args.port, grpc_port=args.grpc_port
+        )
+    pool = ClientPool(
+        connect, size=args.pool_size, acquire_timeout=args.acquire_timeout
+    )
+
+    # Warm up the model and the connections.
+    run_level(pool, embed_query, args, 1, duration=2)
+
+    print(
+        f"{'users':>6}{'requests':>10}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'embed ms':>10}{'errors':>8}"
+    )
+    try:
+        for n_users in args.users:
+            elapsed, latencies, embed_times, errors = run_level(
+                pool, embed_query, args, n_users, args.duration
+            )
+            embed = f"{embed_times.mean() * 1000:.0f}" if len(embed_times) else "-"
+            if len(latencies) == 0:
+                print(
+                    f"{n_users:>6}{0:>10}{'-':>8}{'-':>9}{'-':>9}{'-':>9}{'-':>9}{embed:>10}{len(errors):>8}"
+                )
+                continue
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            print(
+                f"{n_users:>6}{len(latencies):>10}{len(latencies) / elapsed:>8.1f}"
+                f"{p50:>9.0f}{p95:>9.0f}{p99:>9.0f}{latencies.max() * 1000:>9.0f}"
+                f"{embed:>10}{len(errors):>8}"
+            )
+    finally:
+        pool.close()
+        if server is not None:
+            server.close()
+
+
+if __name__ == "__main__":
+    main()
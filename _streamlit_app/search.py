@@ -0,0 +1,187 @@
+"""Search functions of the app without Streamlit, shared with the load test."""
+
+import re
+import weaviate.classes as wvc
+
+# Archive signatures, e.g. "StAZH MM 1.5 RRB 1804/0001" or "StAZH ABl 1987 (S. 1079)":
+# "StAZH", a series code and parts that are series codes, page markers or numbers.
+SERIES_CODE = r"(?:MM|OS|ABl|KRP|RRB)"
+SIGNATURE = re.compile(
+    rf"^StAZH\s+{SERIES_CODE}(?=.*\d)"
+    rf"(?:\s+(?:{SERIES_CODE}|\(?S\.|\(?[\d./,:-]*\d[\d./,:-]*\)?))+$",
+    re.IGNORECASE,
+)
+# RRB numbers, e.g. "RRB 1804/1" or "RRB 1804/0001".
+RRB_NUMBER = re.compile(r"^RRB\s*(\d{4})\s*/\s*(\d{1,4})$", re.IGNORECASE)
+
+
+def get_filters(years, series):
+    """Get filters for publication year and series."""
+    return (
+        wvc.query.Filter.by_property("year").greater_or_equal(years[0])
+        & wvc.query.Filter.by_property("year").less_or_equal(years[1])
+        & wvc.query.Filter.by_property("series").contains_any(series)
+    )
+
+
+def collapse_results(objects, key):
+    """Keep the first result per document and per cluster of near duplicates."""
+    seen = []
+    seen_clusters = []
+    final_results = []
+    for result in objects:
+        if result.properties[key] in seen:
+            continue
+        # Collapse near-duplicate chunks, e.g. laws reprinted in the Amtsblatt.
+        dup_cluster = result.properties.get("dup_cluster")
+        if dup_cluster is not None and dup_cluster in seen_clusters:
+            continue
+        final_results.append(result)
+        seen.append(result.properties[key])
+        seen_clusters.append(dup_cluster)
+    return final_results
+
+
+def is_signature(query):
+    """Whether the query is an archive signature or RRB number."""
+    query = re.sub(r"\s+", " ", query.strip())
+    return bool(RRB_NUMBER.match(query) or SIGNATURE.match(query))
+
+
+def lookup_signature(collection, query, limit):
+    """Look up documents by archive signature or RRB number.
+
+    Returns an empty list if the query is neither or no document matches.
+    """
+    query = re.sub(r"\s+", " ", query.strip())
+    rrb_number = RRB_NUMBER.match(query)
+    if rrb_number:
+        year, doc_no = rrb_number.groups()
+        ident = f"RRB {year}/{int(doc_no):04d}"
+    elif SIGNATURE.match(query):
+        ident = query
+    else:
+        return []
+
+    # Year and series filters are ignored since the user asked for a specific document.
+    response = collection.query.fetch_objects(
+        filters=wvc.query.Filter.by_property("stazh_ident").equal(ident),
+        limit=limit,
+    )
+
+    # The filter matches on tokens, so keep only exact matches of the signature or RRB number.
+    return [
+        x
+        for x in response.objects
+        if x.properties["stazh_ident"].lower().endswith(ident.lower())
+    ]
+
+
+def route_query(alpha):
+    """Choose the search route for the balance between lexical and semantic search.
+
+    At the extremes one side of the hybrid search has no effect on the ranking,
+    so we skip it. In particular, lexical search doesn't need to embed the query.
+    """
+    if alpha == 0.0:
+        return "lexical"
+    if alpha == 1.0:
+        return "vector"
+    return "hybrid"
+
+
+def search_by_terms(collection, search_terms, vector, alpha, limit, years, series):
+    """Search by search terms with the route for `alpha`.
+
+    `vector` is the embedded query, or None for the lexical route.
+
+    Returns
+    -------
+    tuple
+        Results collapsed by document and the route that answered the query.
+    """
+    route = route_query(alpha)
+    if route == "lexical":
+        response = collection.query.bm25(
+            query=search_terms,
+            query_properties=["title", "chunk_text"],
+            limit=limit,
+            filters=get_filters(years, series),
+        )
+    elif route == "vector":
+        response = collection.query.near_vector(
+            near_vector=list(vector),
+            limit=limit,
+            filters=get_filters(years, series),
+        )
+    else:
+        response = collection.query.hybrid(
+            query=search_terms,
+            query_properties=["title", "chunk_text"],
+            vector=list(vector),
+            limit=limit,
+            alpha=alpha,
+            fusion_type=wvc.query.HybridFusion.RELATIVE_SCORE,
+            filters=get_filters(years, series),
+        )
+
+    objects = response.objects if response.objects is not None else []
+    return collapse_results(objects, "identifier"), route
+
+
+def route_and_search(pool, embed_query, search_terms, alpha, limit, years, series):
+    """Answer a query by signature lookup or search by terms.
+
+    Signatures and RRB numbers are looked up directly. If no document matches,
+    the query is searched like any other and the route is logged as e.g.
+    "signature-miss+hybrid". The query is embedded only when the route needs it
+    and before borrowing a client, so that encoding doesn't hold a connection.
+
+    Returns
+    -------
+    tuple
+        Results collapsed by document and the route that answered the query.
+    """
+    prefix = ""
+    if is_signature(search_terms):
+        with pool.collection() as collection:
+            objects = lookup_signature(collection, search_terms, limit)
+        if objects != []:
+            return collapse_results(objects, "identifier"), "signature"
+        prefix = "signature-miss+"
+
+    vector = None
+    if route_query(alpha) != "lexical":
+        vector = embed_query(search_terms)
+    with pool.collection() as collection:
+        final_results, route = search_by_terms(
+            collection, search_terms, vector, alpha, limit, years, series
+        )
+    return final_results, prefix + route
+
+
+def search_by_reference_document(collection, signature, limit, years, series):
+    """Search documents similar to the document with the given signature.
+
+    Returns
+    -------
+    tuple
+        Reference document and results collapsed by signature. The reference
+        document is None if no document with the signature exists.
+    """
+    response = collection.query.fetch_objects(
+        filters=wvc.query.Filter.by_property("stazh_ident").equal(signature)
+    )
+
+    if response.objects == []:
+        return None, []
+
+    reference = response.objects[0]
+    response = collection.query.near_object(
+        near_object=reference.uuid,
+        limit=limit,
+        filters=get_filters(years, series),
+    )
+
+    # The first result is the reference document itself.
+    return reference, collapse_results(response.objects[1:], "stazh_ident")
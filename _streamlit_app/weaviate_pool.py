@@ -0,0 +1,187 @@
+"""Bounded pool of Weaviate clients shared by all sessions of the app."""
+
+import time
+import threading
+from contextlib import contextmanager
+
+import weaviate
+from weaviate.classes.init import AdditionalConfig, Timeout
+from weaviate.exceptions import WeaviateQueryError, WeaviateTimeoutError
+
+# Ports of the embedded Weaviate instance.
+HTTP_PORT = 8079
+GRPC_PORT = 50050
+
+
+class PoolTimeout(Exception):
+    """Raised when no client becomes available within the acquire timeout."""
+
+
+def start_embedded(persistence_data_path=None):
+    """Start the embedded Weaviate instance that the pool connects to.
+
+    Keep the returned client open as long as the pool is used, closing it stops the instance.
+    """
+    if persistence_data_path is None:
+        return weaviate.connect_to_embedded(port=HTTP_PORT, grpc_port=GRPC_PORT)
+    return weaviate.connect_to_embedded(
+        port=HTTP_PORT,
+        grpc_port=GRPC_PORT,
+        persistence_data_path=persistence_data_path,
+    )
+
+
+def local_connector(query_timeout=10, port=HTTP_PORT, grpc_port=GRPC_PORT):
+    """Return a function that connects a new client to a local Weaviate instance.
+
+    Parameters
+    ----------
+    query_timeout : int, optional
+        Timeout in seconds for each query, by default 10.
+    port : int, optional
+        HTTP port of the instance, by default the port of the embedded instance.
+    grpc_port : int, optional
+        gRPC port of the instance, by default the port of the embedded instance.
+    """
+
+    def connect():
+        return weaviate.connect_to_local(
+            port=port,
+            grpc_port=grpc_port,
+            additional_config=AdditionalConfig(timeout=Timeout(query=query_timeout)),
+        )
+
+    return connect
+
+
+class ClientPool:
+    """Bounded pool of Weaviate clients.
+
+    Each query gets a client of its own. If all clients are in use, callers wait
+    up to `acquire_timeout` seconds and then get a `PoolTimeout`, so that load
+    beyond the capacity of the instance is rejected instead of piling up.
+    Idle clients are checked with `is_ready` before reuse and replaced if unhealthy.
+
+    Parameters
+    ----------
+    connect : callable
+        Function that returns a new connected client, e.g. from `local_connector`.
+    size : int, optional
+        Maximum number of clients, by default 4.
+    acquire_timeout : float, optional
+        Seconds to wait for a free client, by default 5.
+    health_check_interval : float, optional
+        Seconds after which an idle client is checked before reuse, by default 30.
+    """
+
+    def __init__(self, connect, size=4, acquire_timeout=5, health_check_interval=30):
+        self.connect = connect
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        # Used as a stack, so that the most recently used, warm clients are reused first.
+        self._idle = []
+        self._created = 0
+        # Notified whenever a client is returned or discarded, so that waiting
+        # threads can take the client or create a new one in the free slot.
+        self._available = threading.Condition()
+
+    def _discard(self, client):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def _release(self, client, checked):
+        with self._available:
+            self._idle.append((client, checked))
+            self._available.notify()
+
+    def _is_healthy(self, client):
+        try:
+            return client.is_ready()
+        except Exception:
+            return False
+
+    def _acquire(self):
+        deadline = time.time() + self.acquire_timeout
+        while True:
+            with self._available:
+                while not self._idle and self._created >= self.size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._available.wait(remaining):
+                        raise PoolTimeout(
+                            f"No Weaviate client available within {self.acquire_timeout} s."
+                        )
+                if self._idle:
+                    client, checked = self._idle.pop()
+                else:
+                    self._created += 1
+                    client = None
+
+            if client is None:
+                try:
+                    return self.connect(), time.time()
+                except Exception:
+                    with self._available:
+                        self._created -= 1
+                        self._available.notify()
+                    raise
+
+            if time.time() - checked < self.health_check_interval:
+                return client, checked
+            if self._is_healthy(client):
+                return client, time.time()
+            self._discard(client)
+
+    @contextmanager
+    def client(self):
+        """Borrow a client for the duration of the `with` block."""
+        client, checked = self._acquire()
+        healthy = True
+        try:
+            yield client
+        except Exception:
+            # Check the client right away, the error might be a lost connection.
+            healthy = self._is_healthy(client)
+            checked = time.time()
+            raise
+        except BaseException:
+            # E.g. KeyboardInterrupt or Streamlit stopping the script in the middle
+            # of a query, the state of the connection is unknown.
+            healthy = False
+            raise
+        finally:
+            # Always give the slot back, otherwise the pool shrinks for good.
+            if healthy:
+                self._release(client, checked)
+            else:
+                self._discard(client)
+
+    @contextmanager
+    def collection(self, name="stazh"):
+        """Borrow a client for the duration of the `with` block and return a collection."""
+        with self.client() as client:
+            yield client.collections.get(name)
+
+    def stats(self):
+        """Return number of clients in total and currently idle."""
+        with self._available:
+            return {"size": self._created, "idle": len(self._idle)}
+
+    def close(self):
+        """Close all idle clients."""
+        with self._available:
+            idle, self._idle = self._idle, []
+        for client, _ in idle:
+            self._discard(client)
+
+
+def is_timeout(error):
+    """Whether a query failed because it exceeded its timeout."""
+    return isinstance(error, WeaviateTimeoutError) or (
+        isinstance(error, WeaviateQueryError) and "DEADLINE_EXCEEDED" in str(error)
+    )
@@ -0,0 +1,351 @@
+"""Prepare all document series in one run.
+
+Replaces running the notebooks 02_krp to 05_abl one after another. The steps
+of every series are declared once in `SERIES` and all series share a single
+process pool, so that e.g. parsing the RRB overlaps with cleaning the KRP.
+Stages whose inputs have not changed since the last run are skipped.
+
+Usage:
+    uv run python pipeline.py
+    uv run python pipeline.py --series rrb os --workers 8 --force
+"""
+
+import os
+import json
+import time
+import hashlib
+import inspect
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+
+import pandas as pd
+from dotenv import load_dotenv
+
+# Suppress Hugginface warning about tokenizers.
+# Set before importing staatsarchiv_utils, which loads the tokenizer.
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+from staatsarchiv_utils import read_XML_files
+from staatsarchiv_utils import parse_XML_files
+from staatsarchiv_utils import fix_missing_dates
+from staatsarchiv_utils import fix_incomplete_dates
+from staatsarchiv_utils import add_missing_month_and_day_to_dates
+from staatsarchiv_utils import parse_dates
+from staatsarchiv_utils import clean_identifiers
+from staatsarchiv_utils import generic_text_cleaning
+from staatsarchiv_utils import ESCAPE_SEQS, ROMAN_NUMERALS
+
+pd.options.mode.chained_assignment = None
+
+load_dotenv()
+
+# ---------------------------------------------------------------
+# Constants
+
+LINK_PROLOG = "https://www.zentraleserien.zh.ch/"
+
+# Per-series configuration. `fix_dates` is the variant to repair incomplete
+# dates, the other steps are the same for all series.
+SERIES = {
+    "krp": {
+        "data_input": os.getenv("DATA_INPUT_KRP"),
+        "raw_output": os.getenv("RAW_OUTPUT_KRP"),
+        "prep_output": os.getenv("PREP_OUTPUT_KRP"),
+        "remove_memberlists": False,
+        "fix_dates": fix_incomplete_dates,
+        "check_duplicates": True,
+    },
+    "rrb": {
+        "data_input": os.getenv("DATA_INPUT_RRB"),
+        "raw_output": os.getenv("RAW_OUTPUT_RRB"),
+        "prep_output": os.getenv("PREP_OUTPUT_RRB"),
+        "remove_memberlists": True,
+        "fix_dates": fix_incomplete_dates,
+        "check_duplicates": False,
+    },
+    "os": {
+        "data_input": os.getenv("DATA_INPUT_OS"),
+        "raw_output": os.getenv("RAW_OUTPUT_OS"),
+        "prep_output": os.getenv("PREP_OUTPUT_OS"),
+        "remove_memberlists": False,
+        "fix_dates": add_missing_month_and_day_to_dates,
+        "check_duplicates": False,
+    },
+    "abl": {
+        "data_input": os.getenv("DATA_INPUT_ABl"),
+        "raw_output": os.getenv("RAW_OUTPUT_ABl"),
+        "prep_output": os.getenv("PREP_OUTPUT_ABl"),
+        "remove_memberlists": False,
+        "fix_dates": add_missing_month_and_day_to_dates,
+        "check_duplicates": False,
+    },
+}
+
+PIPELINE_STATE = os.getenv("PIPELINE_STATE", "_02_data-prep/pipeline_state.json")
+
+COLS = ["identifier", "date", "year", "title", "text", "link", "stazh_ident", "ref"]
+
+
+# ---------------------------------------------------------------
+# Fingerprints
+
+
+def fingerprint_files(file_paths, *extra):
+    """Create a fingerprint from file paths, sizes and modification times.
+
+    Parameters
+    ----------
+    file_paths : list
+        Paths of the input files of a stage.
+    *extra : str
+        Additional values that change the output of the stage, e.g. settings.
+
+    Returns
+    -------
+    str
+        Hex digest of the fingerprint.
+    """
+    h = hashlib.sha256()
+    for path in sorted(file_paths):
+        stat = os.stat(path)
+        h.update(f"{path}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode())
+    for value in extra:
+        h.update(f"{value}\n".encode())
+    return h.hexdigest()
+
+
+def source_of(*funcs):
+    """Return the source code of the given functions to include in a fingerprint."""
+    return "\n".join(inspect.getsource(func) for func in funcs)
+
+
+class PipelineState:
+    """Fingerprints of the last successful run of each stage, stored as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.fingerprints = json.load(f)
+        else:
+            self.fingerprints = {}
+
+    def is_current(self, stage, fingerprint, output):
+        return self.fingerprints.get(stage) == fingerprint and os.path.exists(output)
+
+    def update(self, stage, fingerprint):
+        with self.lock:
+            self.fingerprints[stage] = fingerprint
+            with open(self.path, "w") as f:
+                json.dump(self.fingerprints, f, indent=2, sort_keys=True)
+
+
+# ---------------------------------------------------------------
+# Stages
+
+
+def parse_stage(pool, file_paths, batch_size):
+    """Parse XML files in batches on the shared process pool.
+
+    Parameters
+    ----------
+    pool : ProcessPoolExecutor
+        Process pool shared by all series.
+    file_paths : list
+        Paths of the XML files of one series.
+    batch_size : int
+        Number of files per task.
+
+    Returns
+    -------
+    pd.DataFrame
+        Parsed documents in the order of `file_paths`.
+    """
+    batches = [
+        file_paths[i : i + batch_size] for i in range(0, len(file_paths), batch_size)
+    ]
+    futures = [pool.submit(parse_XML_files, batch, False) for batch in batches]
+    return pd.concat([f.result() for f in futures], ignore_index=True)
+
+
+def prep_stage(pool, df, series, config, chunksize):
+    """Repair dates and identifiers, clean texts and reduce to relevant columns.
+
+    Parameters
+    ----------
+    pool : ProcessPoolExecutor
+        Process pool shared by all series.
+    df : pd.DataFrame
+        Raw data of one series as returned by `parse_stage`.
+    series : str
+        Name of the series, used as prefix for `identifier`.
+    config : dict
+        Configuration of the series from `SERIES`.
+    chunksize : int
+        Number of texts per task for the text cleaning.
+
+    Returns
+    -------
+    pd.DataFrame
+        Prepared data.
+    """
+    if config["check_duplicates"]:
+        # Sanity check that we haven't imported duplicated data.
+        assert df.duplicated().sum() == 0
+
+    # TODO: Here the correct URL of ZSZH has to be set.
+    df["link"] = df.filename.apply(
+        lambda x: f"{LINK_PROLOG}{series}/" + x.replace(".xml", "")
+    )
+    assert df.link.nunique() == len(df)
+
+    df = (
+        df.pipe(fix_missing_dates)
+        .pipe(config["fix_dates"])
+        .pipe(parse_dates)
+        .pipe(clean_identifiers)
+    )
+
+    # Sanity checks.
+    assert df.date_when.isna().sum() == 0
+    assert df.ident.str.contains("\n").sum() == 0
+
+    df["year"] = df.date_when.dt.year
+    df["identifier"] = [f"{series}_{x}" for x in df.index.astype(int)]
+    df.rename({"date_when": "date", "ident": "stazh_ident"}, axis=1, inplace=True)
+    assert df.identifier.nunique() == len(df)
+
+    # Generic text cleaning.
+    df.title = list(pool.map(generic_text_cleaning, df.title, chunksize=chunksize))
+    df.text = list(pool.map(generic_text_cleaning, df.text, chunksize=chunksize))
+
+    return df[COLS]
+
+
+def run_series(pool, state, series, args, timings):
+    """Run all stages of one series and record their timings."""
+    config = SERIES[series]
+
+    start = time.time()
+    file_paths = read_XML_files(
+        config["data_input"], remove_memberlists=config["remove_memberlists"]
+    )
+    if file_paths == []:
+        print(f"{series}: No XML files in {config['data_input']}, skipping series.")
+        timings.append((series, "parse", "skipped", time.time() - start))
+        timings.append((series, "prep", "skipped", 0.0))
+        return
+
+    fingerprint = fingerprint_files(file_paths, source_of(parse_XML_files))
+    stage = f"{series}/parse"
+    if not args.force and state.is_current(stage, fingerprint, config["raw_output"]):
+        timings.append((series, "parse", "skipped", time.time() - start))
+    else:
+        df = parse_stage(pool, file_paths, args.batch_size)
+        df.to_parquet(config["raw_output"])
+        state.update(stage, fingerprint)
+        timings.append((series, "parse", "run", time.time() - start))
+
+    start = time.time()
+    fingerprint = fingerprint_files(
+        [config["raw_output"]],
+        source_of(
+            prep_stage,
+            fix_missing_dates,
+            config["fix_dates"],
+            parse_dates,
+            clean_identifiers,
+            generic_text_cleaning,
+        ),
+        # Settings that change the output without changing the code of the steps.
+        series,
+        LINK_PROLOG,
+        COLS,
+        sorted((k, getattr(v, "__name__", v)) for k, v in config.items()),
+        ESCAPE_SEQS.pattern,
+        ROMAN_NUMERALS.pattern,
+    )
+    stage = f"{series}/prep"
+    if not args.force and state.is_current(stage, fingerprint, config["prep_output"]):
+        timings.append((series, "prep", "skipped", time.time() - start))
+    else:
+        df = pd.read_parquet(config["raw_output"])
+        df = prep_stage(pool, df, series, config, args.chunksize)
+        df.to_parquet(config["prep_output"])
+        state.update(stage, fingerprint)
+        timings.append((series, "prep", "run", time.time() - start))
+        print(f"{series}: {len(df):,.0f} documents prepared.")
+
+
+def print_report(timings, total):
+    """Print the duration of each stage."""
+    print(f"\n{'series':<8}{'stage':<8}{'status':<10}{'seconds':>10}")
+    for series, stage, status, seconds in sorted(timings):
+        print(f"{series:<8}{stage:<8}{status:<10}{seconds:>10.1f}")
+    print(f"{'total (wall time)':<26}{total:>10.1f}")
+
+
+# ---------------------------------------------------------------
+# Main
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--series",
+        nargs="+",
+        choices=list(SERIES),
+        default=list(SERIES),
+        help="Series to prepare, by default all.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes shared by all series.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=200,
+        help="Number of XML files parsed per task.",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=1000,
+        help="Number of texts cleaned per task.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run all stages even if their inputs haven't changed.",
+    )
+    args = parser.parse_args()
+
+    start = time.time()
+    state = PipelineState(PIPELINE_STATE)
+    timings = []
+
+    # Fork the workers before starting the series threads, so they inherit the
+    # already loaded modules and don't fork a multi-threaded process.
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=mp.get_context("fork")
+    ) as pool:
+        pool.submit(os.getpid).result()
+        with ThreadPoolExecutor(max_workers=len(args.series)) as runner:
+            futures = [
+                runner.submit(run_series, pool, state, series, args, timings)
+                for series in args.series
+            ]
+            for future in futures:
+                future.result()
+
+    print_report(timings, time.time() - start)
+
+
+if __name__ == "__main__":
+    main()
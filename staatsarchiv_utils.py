@@ -1,4 +1,5 @@
 import re
+import tempfile
 from tqdm import tqdm
 import pandas as pd
 import numpy as np
@@ -37,7 +38,7 @@ def read_XML_files(folder_path, remove_memberlists=False):
     return xml_file_paths
 
 
-def parse_XML_files(file_paths):
+def parse_XML_files(file_paths, progress_bar=True):
     """
     Parse XML files and extract relevant information.
 
@@ -45,6 +46,8 @@ def parse_XML_files(file_paths):
     ----------
     paths : list
         List of paths to XML files.
+    progress_bar : bool, optional
+        Whether to show a progress bar, by default True.
 
     Returns
     -------
@@ -53,7 +56,7 @@ def parse_XML_files(file_paths):
     """
 
     results = []
-    for file_path in tqdm(file_paths):
+    for file_path in tqdm(file_paths, disable=not progress_bar):
         tmp = []
         with open(file_path) as file:
             soup = BeautifulSoup(file, "lxml")
@@ -410,3 +413,248 @@ def chunk_text(data, max_token_count=512, overlap_tokens=50):
             current_chunk_start = current_sent
 
     return [(data.identifier, chunk) for chunk in chunks]
+
+
+# Mersenne prime and hash family for MinHash permutations, as in datasketch.
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _minhash_batch(texts, shingle_size, perm_a, perm_b):
+    """Compute MinHash signatures of word shingles for a batch of texts.
+
+    Texts with fewer words than `shingle_size` consist of a single shingle.
+
+    Parameters
+    ----------
+    texts : list
+        Texts to compute signatures for.
+    shingle_size : int
+        Number of words per shingle.
+    perm_a, perm_b : np.ndarray
+        Parameters of the hash permutations.
+
+    Returns
+    -------
+    np.ndarray
+        Signatures of shape (len(texts), len(perm_a)) as uint32.
+    """
+    tokens = [text.split() for text in texts]
+    lengths = np.array([len(x) for x in tokens], dtype=np.int64)
+
+    # Lay out all tokens in one array, each text followed by shingle_size - 1 zeros,
+    # so that no shingle spans two texts. Empty texts get one zero token, so that
+    # their single shingle also stays within their own slots.
+    stride = np.maximum(lengths, 1) + shingle_size - 1
+    offsets = np.concatenate([[0], np.cumsum(stride)[:-1]])
+    flat = np.zeros(stride.sum(), dtype=np.uint64)
+    positions = np.repeat(offsets, lengths) + (
+        np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    )
+    flat[positions] = pd.util.hash_array(
+        np.array([t for x in tokens for t in x], dtype=object)
+    )
+
+    # Combine consecutive token hashes to shingle hashes.
+    n_windows = len(flat) - shingle_size + 1
+    shingles = np.zeros(n_windows, dtype=np.uint64)
+    for j in range(shingle_size):
+        shingles = shingles * np.uint64(1_000_003) + flat[j : j + n_windows]
+
+    # Select the shingles that start within each text.
+    n_shingles = np.maximum(lengths - shingle_size + 1, 1)
+    starts = np.repeat(offsets, n_shingles) + (
+        np.arange(n_shingles.sum())
+        - np.repeat(np.cumsum(n_shingles) - n_shingles, n_shingles)
+    )
+    shingles = shingles[starts] >> np.uint64(32)
+    segments = np.concatenate([[0], np.cumsum(n_shingles)[:-1]])
+
+    signatures = np.empty((len(texts), len(perm_a)), dtype=np.uint32)
+    for i, (a, b) in enumerate(zip(perm_a, perm_b)):
+        hashed = ((a * shingles + b) % MERSENNE_PRIME) & MAX_HASH
+        signatures[:, i] = np.minimum.reduceat(hashed, segments)
+    return signatures
+
+
+def _lsh_params(threshold, num_perm, min_recall=0.99):
+    """Choose number of bands and rows per band for a similarity threshold.
+
+    A pair with similarity s becomes a candidate with probability
+    1 - (1 - s ** rows) ** bands. Candidates are verified against the full
+    signatures, so false positives only cost compute. We therefore require a
+    candidate probability of at least `min_recall` at `threshold` and, among
+    those splits of `num_perm`, minimise the false positive area below it.
+    """
+    s = np.linspace(0, threshold, 1001)
+
+    def candidate_probability(params, x):
+        bands, rows = params
+        return 1 - (1 - x**rows) ** bands
+
+    candidates = [
+        (bands, rows)
+        for bands in range(1, num_perm + 1)
+        for rows in range(1, num_perm // bands + 1)
+    ]
+    feasible = [
+        x for x in candidates if candidate_probability(x, threshold) >= min_recall
+    ]
+    if feasible == []:
+        # Only possible for very low thresholds, take the split with the highest recall.
+        return max(candidates, key=lambda x: candidate_probability(x, threshold))
+    return min(feasible, key=lambda x: np.trapezoid(candidate_probability(x, s), s))
+
+
+def _find_root(parent, i):
+    """Find root of `i` in a union-find forest with path halving."""
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def mark_near_duplicates(
+    data,
+    threshold=0.9,
+    num_perm=128,
+    shingle_size=5,
+    batch_size=10_000,
+    seed=42,
+    tmp_dir=None,
+):
+    """Cluster near-duplicate chunks with MinHash and LSH.
+
+    Chunks whose estimated Jaccard similarity of word shingles in `chunk_text`
+    is at least `threshold` are linked into the same cluster if they share at
+    least one LSH band. This is probabilistic: bands are chosen so that a pair
+    at exactly `threshold` becomes a candidate with at least 99% probability,
+    rising quickly above it, but a few near duplicates may stay separate. Since
+    candidates are verified, fewer rows per band only cost compute. Per cluster,
+    the chunk with the earliest date is kept as canonical representative. Signatures are
+    kept in a memory mapped file, so memory usage only grows with the batch size
+    and one integer per chunk.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Chunks as created by `chunk_text`, with columns `chunk_text`, `date` and `identifier`.
+    threshold : float, optional
+        Minimum similarity for chunks to count as duplicates, by default 0.9.
+    num_perm : int, optional
+        Number of hash permutations, by default 128.
+    shingle_size : int, optional
+        Number of words per shingle, by default 5.
+    batch_size : int, optional
+        Number of chunks to compute signatures for at once, by default 10_000.
+    seed : int, optional
+        Seed for the hash permutations, by default 42.
+    tmp_dir : str, optional
+        Directory for the memory mapped signatures, by default the system temp directory.
+
+    Returns
+    -------
+    data : pd.DataFrame
+        Data with index reset and new columns `dup_cluster` (position of the
+        canonical chunk of the cluster) and `is_canonical`.
+    """
+    # Sort so that the canonical chunk of each cluster is the one with the lowest position.
+    data = data.sort_values(["date", "identifier"], kind="stable").reset_index(
+        drop=True
+    )
+    n = len(data)
+
+    rng = np.random.RandomState(seed)
+    perm_a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    perm_b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    bands, rows = _lsh_params(threshold, num_perm)
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        signatures = np.lib.format.open_memmap(
+            f"{tmp}/signatures.npy", mode="w+", dtype=np.uint32, shape=(n, num_perm)
+        )
+        for start in tqdm(range(0, n, batch_size), desc="Signatures"):
+            texts = data.chunk_text.iloc[start : start + batch_size].tolist()
+            signatures[start : start + len(texts)] = _minhash_batch(
+                texts, shingle_size, perm_a, perm_b
+            )
+
+        parent = np.arange(n, dtype=np.int64)
+        for band in tqdm(range(bands), desc="LSH bands"):
+            # Hash the rows of this band to one bucket key per chunk.
+            keys = np.zeros(n, dtype=np.uint64)
+            for start in range(0, n, batch_size):
+                block = signatures[
+                    start : start + batch_size, band * rows : (band + 1) * rows
+                ]
+                for col in block.T:
+                    keys[start : start + len(block)] = (
+                        keys[start : start + len(block)] * np.uint64(1_000_003) + col
+                    )
+
+            # Chunks with the same key are candidates. Verify each member of a bucket
+            # against the first member. Members that don't match form the remaining
+            # bucket and are verified against its new first member in the next round.
+            # A member similar only to an already matched member other than the first
+            # is not linked in this band, but usually is through another band.
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+            while len(order) > 1:
+                is_head = np.concatenate([[True], keys[1:] != keys[:-1]])
+                head = np.maximum.accumulate(
+                    np.where(is_head, np.arange(len(order)), 0)
+                )
+                candidates = np.flatnonzero(~is_head)
+                matched = np.zeros(len(order), dtype=bool)
+                for start in range(0, len(candidates), batch_size):
+                    pos = candidates[start : start + batch_size]
+                    left, right = order[head[pos]], order[pos]
+                    similarity = (signatures[left] == signatures[right]).mean(axis=1)
+                    matched[pos] = similarity >= threshold
+                    for i, j in zip(
+                        left[similarity >= threshold], right[similarity >= threshold]
+                    ):
+                        root_i, root_j = _find_root(parent, i), _find_root(parent, j)
+                        if root_i != root_j:
+                            parent[max(root_i, root_j)] = min(root_i, root_j)
+                remaining = ~is_head & ~matched
+                order, keys = order[remaining], keys[remaining]
+            del keys, order
+        del signatures
+
+    data["dup_cluster"] = [_find_root(parent, i) for i in range(n)]
+    data["is_canonical"] = data.dup_cluster == data.index
+    report_duplicate_savings(data)
+    return data
+
+
+def report_duplicate_savings(data, embedding_dim=768):
+    """Print how many chunks deduplication saves for embedding and indexing.
+
+    Only canonical chunks are embedded. Whether the index shrinks depends on
+    whether duplicates are indexed with the vector of their canonical chunk
+    (`INDEX_DUPLICATES` in 07_create_search-index.ipynb), so we report the
+    index size for both settings.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Chunks as returned by `mark_near_duplicates`.
+    embedding_dim : int, optional
+        Dimension of the embedding vectors, by default 768.
+    """
+    duplicates = data[~data.is_canonical]
+    n_clusters = data[data.dup_cluster.duplicated(keep=False)].dup_cluster.nunique()
+    vector_bytes = embedding_dim * 4
+    index_all = len(data) * vector_bytes + data.chunk_text.str.len().sum()
+    index_dups = len(duplicates) * vector_bytes + duplicates.chunk_text.str.len().sum()
+
+    print(
+        f"{len(data):,.0f} chunks, {len(duplicates):,.0f} near duplicates in {n_clusters:,.0f} clusters."
+    )
+    print(f"Embedding: {len(duplicates) / len(data):.1%} fewer chunks to embed.")
+    print(
+        f"Index (vectors and texts): {index_all / 1e9:,.2f} GB with duplicates "
+        f"(INDEX_DUPLICATES = True), {(index_all - index_dups) / 1e9:,.2f} GB "
+        f"with canonical chunks only (INDEX_DUPLICATES = False)."
+    )